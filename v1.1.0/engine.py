@@ -2,21 +2,44 @@
 A 3dequalizer4 engine for Tank.
 
 """
-from __future__ import print_function
-import datetime
 import logging
 import os
-import re
-import shutil
-import subprocess
 import sys
 
 import sgtk
 from sgtk.platform import Engine
 
 
+# file browser command used by the jump to file system callback
+_OPEN_CMD = {
+    "linux": ["xdg-open"],
+    "linux2": ["xdg-open"],
+    "darwin": ["open"],
+    "win32": ["cmd.exe", "/C", "start", "Folder"],
+}
+
+# mel export unit scales indexed by units - 1
+# 1 : cm -> cm, 2 : cm -> m, 3 : cm -> mm, 4 : cm -> in, 5 : cm -> ft, 6 : cm -> yd
+_UNIT_SCALES = (1.0, 0.01, 10.0, 0.393701, 0.0328084, 0.0109361)
+
+# (tde4, _maya_export_mel_file), filled in by _lazy_export_deps
+_EXPORT_DEPS = None
+
+# (QtCore, QtGui), filled in by _qt
+_QT = None
+
+
 class TDE4Engine(Engine):
 
+    # compiled lazily by host_info to keep re off the import path
+    _VERSION_RE = None
+
+    # LogManager singleton, looked up on the first debug record
+    _log_manager = None
+
+    # signature of the last menu built by create_shotgun_menu
+    _last_menu_sig = None
+
     @property
     def context_change_allowed(self):
         """
@@ -41,8 +64,11 @@ class TDE4Engine(Engine):
         host_info = {"name": "3DEqualizer4", "version": "unknown"}
         try:
             import tde4
-            host_info["name"], host_info["version"] = re.match(
-                "^([^\s]+)\s+(.*)$", tde4.get3DEVersion()
+            if TDE4Engine._VERSION_RE is None:
+                import re
+                TDE4Engine._VERSION_RE = re.compile(r"^(\S+)\s+(.*)$")
+            host_info["name"], host_info["version"] = TDE4Engine._VERSION_RE.match(
+                tde4.get3DEVersion()
             ).groups()
         except:
             # Fallback to initialized above
@@ -55,6 +81,12 @@ class TDE4Engine(Engine):
         Create the shotgun menu
         """
         if self.has_ui:
+            # the menu only depends on the context and the loaded apps, so
+            # skip the rebuild and rescan when neither has changed.
+            menu_sig = self._menu_signature()
+            if menu_sig == self._last_menu_sig:
+                return True
+
             self.register_command(
                 "Jump to Shotgun",
                 self._jump_to_shotgun,
@@ -89,9 +121,25 @@ class TDE4Engine(Engine):
             import tde4
             tde4.rescanPythonDirs()
 
+            self._last_menu_sig = menu_sig
             return True
         return False
 
+    def _menu_signature(self):
+        """
+        Build a signature of everything the shotgun menu is generated from.
+
+        :returns: tuple of the context entity ids and the loaded app names.
+        """
+        ctx = self.context
+        return (
+            tuple(
+                entity and entity["id"]
+                for entity in (ctx.project, ctx.entity, ctx.step, ctx.task)
+            ),
+            tuple(sorted(self.apps)),
+        )
+
     def post_app_init(self):
         """
         Executed by the system and typically implemented by deriving classes.
@@ -131,9 +179,12 @@ class TDE4Engine(Engine):
         This always returns False for some engines (such as the shell engine) and may vary
         for some engines, depending if the host application for example is in batch mode or
         UI mode.
+        Setting the ``TK_3DE4_BATCH`` environment variable to ``1``, ``true`` or
+        ``yes`` (e.g. for farm jobs) flags the session as headless, which skips
+        all menu generation. Any other value, such as ``0``, keeps the UI.
         :returns: boolean value indicating if a UI currently exists
         """
-        return True
+        return os.environ.get("TK_3DE4_BATCH", "").strip().lower() not in ("1", "true", "yes")
 
     ##########################################################################################
     # logging
@@ -165,11 +216,22 @@ class TDE4Engine(Engine):
         :param record: Std python logging record
         :type record: :class:`~python.logging.LogRecord`
         """
-        log_debug = record.levelno < logging.INFO and sgtk.LogManager().global_debug
-        log_info_above = record.levelno >= logging.INFO
-        if log_debug or log_info_above:
-            msg = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]
-            print(msg, handler.format(record))
+        if record.levelno < logging.INFO:
+            if self._log_manager is None:
+                self._log_manager = sgtk.LogManager()
+            if not self._log_manager.global_debug:
+                # dropped record, don't pay for any formatting
+                return
+
+        import time
+        # reuse the record's own timestamp; milliseconds are computed
+        # arithmetically rather than through %f
+        now = record.created
+        msg = "%s,%03d" % (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)),
+            int((now - int(now)) * 1000),
+        )
+        print(msg, handler.format(record))
 
     def _create_dialog(self, title, bundle, widget, parent):
         """
@@ -181,7 +243,7 @@ class TDE4Engine(Engine):
         :param widget: A QWidget instance to be embedded in the newly created dialog.
         :type widget: :class:`PySide.QtGui.QWidget`
         """
-        from sgtk.platform.qt import QtCore
+        QtCore, QtGui = _qt()
         dialog = super(TDE4Engine, self)._create_dialog(title, bundle, widget, parent)
         dialog.setWindowFlags(dialog.windowFlags() | QtCore.Qt.WindowStaysOnTopHint)
         dialog.setWindowState(
@@ -197,7 +259,7 @@ class TDE4Engine(Engine):
         """
         Jump to shotgun, launch web browser
         """
-        from sgtk.platform.qt import QtCore, QtGui
+        QtCore, QtGui = _qt()
         url = self.context.shotgun_url
         QtGui.QDesktopServices.openUrl(QtCore.QUrl(url))
 
@@ -205,42 +267,41 @@ class TDE4Engine(Engine):
         """
         Jump from context to the filesystem
         """
+        import subprocess
+
         # launch one window for each location on disk
         paths = self.context.filesystem_locations
-        # get the setting
-        system = sys.platform
-        # run the app
-        if system == "linux2" or system == "linux":
-            cmd = ["xdg-open"]
-        elif system == "darwin":
-            cmd = ["open"]
-        elif system == "win32":
-            cmd = ["cmd.exe", "/C", "start", "Folder"]
-        else:
-            raise Exception("Platform {} is not supported.".format(system))
+        # single lookup in the platform table, None if unsupported
+        cmd = _OPEN_CMD.get(sys.platform)
+        if cmd is None:
+            raise Exception("Platform {} is not supported.".format(sys.platform))
+        # spawn all the file browsers at once; they are gui launchers so we
+        # don't wait on them, just reap whichever already exited.
+        procs = []
         for disk_location in paths:
             args = cmd + [disk_location]
             try:
-                subprocess.check_call(args)
+                procs.append(
+                    subprocess.Popen(
+                        args,
+                        stdin=subprocess.DEVNULL,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                        close_fds=True,
+                        start_new_session=True,
+                    )
+                )
             except Exception as error:
                 cmdline = subprocess.list2cmdline(args)
                 self.logger.exception("Failed to launch {}!".format(cmdline))
+        for proc in procs:
+            proc.poll()
 
     def _export_mel(self):
         """
         Exports Mel file from 3de4 to maya 
         """
-        import os
-        import sgtk
-        from sgtk.util.filesystem import ensure_folder_exists
-
-        # from .camera import TDECamera
-        # from .lens import TDELens
-        # from .point_group import TDEPointGroup
-        import builtins as builtin
-        import tde4
-        from export_maya import _maya_export_mel_file
-
+        tde4, _maya_export_mel_file = _lazy_export_deps()
 
         # _export_requester_maya	= tde4.createCustomRequester()
         # req	 = _export_requester_maya
@@ -260,16 +321,15 @@ class TDE4Engine(Engine):
         #print(tde4.getWidgetValue(req,"camera_selection"))
         #print(tde4.getWidgetValue(req,"model_selection"))
 
-        campg	= None
-        pgl	= tde4.getPGroupList()
-        for pg in pgl:
-            if tde4.getPGroupType(pg)=="CAMERA": campg = pg
+        # a 3de4 project holds at most one camera point group
+        getPGroupType = tde4.getPGroupType
+        campg	= next((pg for pg in tde4.getPGroupList() if getPGroupType(pg)=="CAMERA"), None)
         # if campg==None:
         #     tde4.postQuestionRequester("Export Maya...","Error, there is no camera point group.","Ok")
 
         cam	= tde4.getCurrentCamera()
         offset	= tde4.getCameraFrameOffset(cam)
-        startFrame = builtin.float(builtin.str(offset))
+        startFrame = float(offset)
         #tde4.setWidgetValue(req,"startframe_field",builtin.str(offset))
         # ret	= tde4.postCustomRequester(req,"Export Maya (MEL-Script)...",700,0,"Ok","Cancel")
 
@@ -282,29 +342,24 @@ class TDE4Engine(Engine):
         overscan_w_pc = 1.0 #builtin.float(tde4.getWidgetValue(req,"export_overscan_width_percent"))/100.0
         overscan_h_pc = 1.0 #builtin.float(tde4.getWidgetValue(req,"export_overscan_height_percent"))/100.0
         export_material = 0 #tde4.getWidgetValue(req,"export_texture")
-        camera_list = tde4.getCameraList()
 
-        #1 : cm -> cm,2 : cm -> m, 3 : cm -> mm,4 : cm -> in,5 : cm -> ft,6 : cm -> yd
-        unit_scales = {1 : 1.0,2 : 0.01,  3 : 10.0, 4 : 0.393701, 5 : 0.0328084, 6 : 0.0109361} 
-        #print(unit_scales[tde4.getWidgetValue(req,"units")])
-        unit_scale_factor = unit_scales[1.0]#unit_scales[tde4.getWidgetValue(req,"units")]
+        units = 1 #tde4.getWidgetValue(req,"units")
+        unit_scale_factor = _UNIT_SCALES[units - 1]
 
         if camera_selection == 1:
-            camera_list = [tde4.getCurrentCamera()]
+            camera_list = [cam]
         elif camera_selection == 2:
             camera_list = tde4.getCameraList(1)
-        elif camera_selection == 3:
-            camera_list = []
-            tcl =  tde4.getCameraList()
-            for c in tcl:
-                if tde4.getCameraType(c) == "SEQUENCE":
-                    camera_list.append(c)
-        elif camera_selection == 4:
-            camera_list = []
-            tcl =  tde4.getCameraList()
-            for c in tcl:
-                if tde4.getCameraType(c) == "REF_FRAME":
-                    camera_list.append(c)
+        else:
+            # only query the full camera list once
+            all_cameras = tde4.getCameraList()
+            getCameraType = tde4.getCameraType
+            if camera_selection == 3:
+                camera_list = [c for c in all_cameras if getCameraType(c) == "SEQUENCE"]
+            elif camera_selection == 4:
+                camera_list = [c for c in all_cameras if getCameraType(c) == "REF_FRAME"]
+            else:
+                camera_list = all_cameras
 
         path	= "/mnt/assets/katana_sg_dev/sequences/Jay_SEQ001/JY_SH001/MMV/work/maya_export/tst.mel" #tde4.getWidgetValue(req,"file_browser")
         frame0	= startFrame #builtin.float(tde4.getWidgetValue(req,"startframe_field"))
@@ -313,91 +368,6 @@ class TDE4Engine(Engine):
         hide_ref= 0 #tde4.getWidgetValue(req,"hide_ref_frames")
         
         _maya_export_mel_file(path,campg,camera_list,model_selection,overscan_w_pc,overscan_h_pc,export_material,unit_scale_factor,frame0,hide_ref)
-        
-        # # if ok==1:
-        # #     tde4.postQuestionRequester("Export Maya...","Project successfully exported.","Ok")
-        # # else:
-        # #     tde4.postQuestionRequester("Export Maya...","Error, couldn't open file.","Ok")
-        # import os
-        # import sgtk
-        # from sgtk.util.filesystem import ensure_folder_exists
-
-        # # from .camera import TDECamera
-        # # from .lens import TDELens
-        # # from .point_group import TDEPointGroup
-        # import builtins as builtin
-        # import tde4
-        # from export_maya import _maya_export_mel_file
-
-
-        # _export_requester_maya	= tde4.createCustomRequester()
-        # req	 = _export_requester_maya
-        # tde4.addFileWidget(req,"file_browser","Exportfile...","*.mel")
-        # tde4.addTextFieldWidget(req, "startframe_field", "Startframe", "1")
-        # tde4.addOptionMenuWidget(req,"camera_selection","Export", "Current Camera Only", "Selected Cameras Only", "Sequence Cameras Only", "Reference Cameras Only","All Cameras")
-        # tde4.setWidgetValue(req,"camera_selection","5")
-        # tde4.addToggleWidget(req,"hide_ref_frames","Hide Reference Frames",0)
-        # tde4.addOptionMenuWidget(req,"model_selection","Export", "No 3D Models At All", "Selected 3D Models Only","All 3D Models")
-        # tde4.setWidgetValue(req,"model_selection","3")
-        # tde4.addToggleWidget(req,"export_texture","Export UV Textures",0)
-        # tde4.addTextFieldWidget(req,"export_overscan_width_percent","Overscan Width %","100")
-        # tde4.addTextFieldWidget(req,"export_overscan_height_percent","Overscan Height %","100")
-        # tde4.setWidgetValue(req,"model_selection","1")
-        # tde4.addOptionMenuWidget(req,"units","Units","cm", "m", "mm","in","ft","yd")
-
-        # campg	= None
-        # pgl	= tde4.getPGroupList()
-        # for pg in pgl:
-        #     if tde4.getPGroupType(pg)=="CAMERA": campg = pg
-        # if campg==None:
-        #     tde4.postQuestionRequester("Export Maya...","Error, there is no camera point group.","Ok")
-
-        # cam	= tde4.getCurrentCamera()
-        # offset	= tde4.getCameraFrameOffset(cam)
-        # tde4.setWidgetValue(req,"startframe_field",builtin.str(offset))
-        # ret	= tde4.postCustomRequester(req,"Export Maya (MEL-Script)...",700,0,"Ok","Cancel")
-
-        # if ret==1:
-        #     camera_selection = tde4.getWidgetValue(req,"camera_selection")
-        #     model_selection = tde4.getWidgetValue(req,"model_selection")
-
-        #     overscan_w_pc = builtin.float(tde4.getWidgetValue(req,"export_overscan_width_percent"))/100.0
-        #     overscan_h_pc = builtin.float(tde4.getWidgetValue(req,"export_overscan_height_percent"))/100.0
-        #     export_material = tde4.getWidgetValue(req,"export_texture")
-        #     camera_list = tde4.getCameraList()
-
-        #     #1 : cm -> cm,2 : cm -> m, 3 : cm -> mm,4 : cm -> in,5 : cm -> ft,6 : cm -> yd
-        #     unit_scales = {1 : 1.0,2 : 0.01,  3 : 10.0, 4 : 0.393701, 5 : 0.0328084, 6 : 0.0109361} 
-        #     unit_scale_factor = unit_scales[tde4.getWidgetValue(req,"units")]
-
-        #     if camera_selection == 1:
-        #         camera_list = [tde4.getCurrentCamera()]
-        #     elif camera_selection == 2:
-        #         camera_list = tde4.getCameraList(1)
-        #     elif camera_selection == 3:
-        #         camera_list = []
-        #         tcl =  tde4.getCameraList()
-        #         for c in tcl:
-        #             if tde4.getCameraType(c) == "SEQUENCE":
-        #                 camera_list.append(c)
-        #     elif camera_selection == 4:
-        #         camera_list = []
-        #         tcl =  tde4.getCameraList()
-        #         for c in tcl:
-        #             if tde4.getCameraType(c) == "REF_FRAME":
-        #                 camera_list.append(c)
-
-        #     path	= tde4.getWidgetValue(req,"file_browser")
-        #     frame0	= builtin.float(tde4.getWidgetValue(req,"startframe_field"))
-        #     frame0	-= 1
-        #     hide_ref= tde4.getWidgetValue(req,"hide_ref_frames")
-            
-        #     ok	= _maya_export_mel_file(path,campg,camera_list,model_selection,overscan_w_pc,overscan_h_pc,export_material,unit_scale_factor,frame0,hide_ref)
-            
-        #     if ok==1:
-        #         tde4.postQuestionRequester("Export Maya...","Project successfully exported.","Ok")
-        #     else:
-        #         tde4.postQuestionRequester("Export Maya...","Error, couldn't open file.","Ok")
 
     def _cleanup_folders(self):
         """
@@ -405,4 +375,55 @@ class TDE4Engine(Engine):
         """
         custom_scripts_dir_path = os.environ["TK_3DE4_MENU_DIR"]
         if os.path.isdir(custom_scripts_dir_path):
-            shutil.rmtree(custom_scripts_dir_path)
+            # removed inline: the folder is shared by the whole process, so a
+            # restarted engine must not rebuild its menus while it's deleted
+            try:
+                _fast_rmtree(custom_scripts_dir_path)
+            except OSError:
+                self.logger.exception(
+                    "Could not remove the menu folder %s", custom_scripts_dir_path)
+
+
+def _qt():
+    """
+    Resolve the Qt modules through the sgtk shim on first use.
+
+    :returns: Tuple of the ``QtCore`` and ``QtGui`` modules.
+    """
+    global _QT
+    if _QT is None:
+        from sgtk.platform.qt import QtCore, QtGui
+        _QT = (QtCore, QtGui)
+    return _QT
+
+
+def _lazy_export_deps():
+    """
+    Import the modules needed by the mel export on first use.
+
+    :returns: Tuple of the ``tde4`` module and ``_maya_export_mel_file``.
+    """
+    global _EXPORT_DEPS
+    if _EXPORT_DEPS is None:
+        import tde4
+        from export_maya import _maya_export_mel_file
+        _EXPORT_DEPS = (tde4, _maya_export_mel_file)
+    return _EXPORT_DEPS
+
+
+def _fast_rmtree(path):
+    """
+    Recursively remove a directory tree.
+
+    Uses the dirent type returned by scandir so no extra stat is issued per
+    entry, unlike shutil.rmtree.
+
+    :param str path: Directory to remove.
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                _fast_rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+    os.rmdir(path)
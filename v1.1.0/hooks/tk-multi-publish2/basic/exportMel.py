@@ -9,16 +9,24 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 import os
+import re
 import sys
 import shutil
 import sgtk
 from sgtk.util.filesystem import ensure_folder_exists
 
 import tde4
+from export_maya import _maya_export_mel_file
 
 
 HookBaseClass = sgtk.get_hook_baseclass()
 
+# folders already created/checked by _ensure_folder during this session
+_ensured_dirs = set()
+
+# zero config version pattern, e.g. filename.v001.3de / filename_v001.3de
+_VERSION_RE = re.compile(r"^(.*?[._-])(v)(\d+)(\.[^.]+)$", re.IGNORECASE)
+
 
 class Tde4ExportMelPublishPlugin(HookBaseClass):
     """
@@ -193,6 +201,12 @@ class Tde4ExportMelPublishPlugin(HookBaseClass):
                 "The mel session has not been saved.",
                 extra=_get_save_as_action()
             )
+            # nothing to export from, don't queue validation for this item
+            return {"accepted": False}
+
+        # keep the normalized path so the later phases don't have to query
+        # and normalize it again.
+        item.properties["path"] = sgtk.util.ShotgunPath.normalize(path)
 
         self.logger.info(
             "mel '%s' plugin accepted the current mel session." %
@@ -273,8 +287,18 @@ class Tde4ExportMelPublishPlugin(HookBaseClass):
         if next_version_path and os.path.exists(next_version_path):
 
             # determine the next available version_number. just keep asking for
-            # the next one until we get one that doesn't exist.
-            while os.path.exists(next_version_path):
+            # the next one until we get one that doesn't exist. the folder is
+            # listed once so each candidate is a set lookup rather than a stat.
+            version_dir = os.path.dirname(next_version_path)
+            existing_files = set(os.listdir(version_dir))
+
+            def _version_exists(version_path):
+                if os.path.dirname(version_path) == version_dir:
+                    return os.path.basename(version_path) in existing_files
+                # the version lives in its own folder, check it directly
+                return os.path.exists(version_path)
+
+            while _version_exists(next_version_path):
                 (next_version_path, version) = self._get_next_version_info(
                     next_version_path, item)
 
@@ -314,15 +338,10 @@ class Tde4ExportMelPublishPlugin(HookBaseClass):
             instances.
         :param item: Item to process
         """
-        # get the path in a normalized state. no trailing separator, separators
-        # are appropriate for current os, no double separators, etc.
-        path = sgtk.util.ShotgunPath.normalize(_session_path())
-
-        # ensure the session is saved
-        _save_session(path)
-
-        # update the item with the saved session path
-        item.properties["path"] = path
+        # the normalized session path, stored on the item by validate. the mel
+        # is exported from the scene that is already open, so the session
+        # doesn't have to be written again to publish it.
+        path = item.properties["path"]
 
         # add dependencies for the base class to register when publishing
         item.properties["publish_dependencies"] = _3de4_find_additional_session_dependencies()
@@ -346,25 +365,21 @@ class Tde4ExportMelPublishPlugin(HookBaseClass):
         """
         publisher = self.parent
  
-        path = sgtk.util.ShotgunPath.normalize(_session_path())
-        item.properties["path"] = path
+        # the normalized session path, stored on the item by validate
+        path = item.properties["path"]
 
         #since we publish script using sgtk we get a few publish data to fill
-        Tpublish_name = self.get_publish_name(settings, item)
+        publish_name = os.path.splitext(self.get_publish_name(settings, item))[0]
         publish_version = self.get_publish_version(settings, item)
 
-        publish_name, Item_file_extension = os.path.splitext(Tpublish_name)
-        publish_name = publish_name
-        publish_fl_name = publish_name + "_v" + str(publish_version).zfill(3) + ".mel"
-
-        #get path from a specified template
-        Mpublish_path = self.get_SpecificTemplatePublishPath(path,publish_version,"3de4_shot_mel_export")
-
-        publishedMelPath = os.path.join(os.path.abspath(Mpublish_path),publish_fl_name)
+        #get the full mel path from a specified template
+        publishedMelPath = self.get_SpecificTemplatePublishPath(
+            path,publish_version,"3de4_shot_mel_export",publish_name)
+        publish_fl_name = os.path.basename(publishedMelPath)
 
         #copy published mel script to the correct folder
         try:
-            _copyToMelPath(path,Mpublish_path)
+            _copyToMelPath(path,publishedMelPath)
         except Exception:
             raise Exception("Unable to export mel script")
 
@@ -378,22 +393,58 @@ class Tde4ExportMelPublishPlugin(HookBaseClass):
         except Exception:
             raise Exception("Unable to publish mel script")
 
+    def _get_next_version_info(self, path, item):
+        """
+        Return the next version of the supplied path.
+
+        Session paths without a work template are bumped with the precompiled
+        version pattern, everything else is left to the base class.
+
+        :param str path: A path with a version number.
+        :param item: The current item being published
+
+        :return: A tuple of the form ``(next_version_path, version)``
+        """
+        if path and not item.properties.get("work_template"):
+            match = _VERSION_RE.match(os.path.basename(path))
+            if match:
+                prefix, v, cur_version, ext = match.groups()
+                version = int(cur_version) + 1
+                next_version_name = "%s%s%0*d%s" % (
+                    prefix, v, len(cur_version), version, ext)
+                return os.path.join(os.path.dirname(path), next_version_name), version
+
+        return super(Tde4ExportMelPublishPlugin, self)._get_next_version_info(path, item)
+
     #path request for a specific template 
-    def get_SpecificTemplatePublishPath(self,path,version,specificTemplate):
+    def get_SpecificTemplatePublishPath(self,path,version,specificTemplate,name=None):
         path = os.path.abspath(path)
         specificTemplate = str(specificTemplate)
-        current_engine = sgtk.platform.current_engine()
-        tk = current_engine.sgtk
-        ctx = tk.context_from_path(path)
-        template = tk.templates[specificTemplate]
+
+        # resolve the tk instance once and memoize the template and context
+        # lookups, context_from_path walks the templates against the path.
+        if not hasattr(self, "_tk"):
+            self._tk = sgtk.platform.current_engine().sgtk
+            self._tpl_cache = {}
+            self._ctx_cache = {}
+        tk = self._tk
+
+        ctx = self._ctx_cache.get(path)
+        if ctx is None:
+            ctx = self._ctx_cache[path] = tk.context_from_path(path)
+        template = self._tpl_cache.get(specificTemplate)
+        if template is None:
+            template = self._tpl_cache[specificTemplate] = tk.templates[specificTemplate]
         fields = ctx.as_template_fields(template)
         fields["version"] = version
-        pPublish_path = template.apply_fields(fields)
 
-        #for adding the task name to the publish name fields
-        pPublish_path = pPublish_path.rsplit('/',1)[0]
-        
-        return pPublish_path
+        #let the template render the file name as well
+        if name and "name" in template.keys:
+            fields["name"] = name
+        if "extension" in template.keys:
+            fields["extension"] = "mel"
+
+        return template.apply_fields(fields)
 
 
 def _3de4_find_additional_session_dependencies():
@@ -420,7 +471,18 @@ def _save_session(path):
     Save the current session to the supplied path.
     """
     # Ensure that the folder is created when saving
-    ensure_folder_exists(os.path.dirname(path))
+    _ensure_folder(os.path.dirname(path))
+    tde4.saveProject(path)
+
+def _ensure_folder(path):
+    """
+    ensure_folder_exists, skipped for folders already ensured by this process.
+    """
+    path = os.path.abspath(path)
+    if path in _ensured_dirs:
+        return
+    ensure_folder_exists(path)
+    _ensured_dirs.add(path)
 
 def _get_save_as_action():
     """
@@ -451,9 +513,6 @@ def _export_mel(path):
     """
     Exports Mel file from 3de4 to maya 
     """
-    import builtins as builtin
-    from export_maya import _maya_export_mel_file
-
     campg	= None
     pgl	= tde4.getPGroupList()
     for pg in pgl:
@@ -461,7 +520,7 @@ def _export_mel(path):
 
     cam	= tde4.getCurrentCamera()
     offset	= tde4.getCameraFrameOffset(cam)
-    startFrame = builtin.float(builtin.str(offset))
+    startFrame = float(offset)
 
     camera_selection = 5 
     model_selection = 1 
@@ -469,28 +528,22 @@ def _export_mel(path):
     overscan_w_pc = 1.0 
     overscan_h_pc = 1.0 
     export_material = 0 
-    camera_list = tde4.getCameraList()
 
-    #1 : cm -> cm,2 : cm -> m, 3 : cm -> mm,4 : cm -> in,5 : cm -> ft,6 : cm -> yd
-    unit_scales = {1 : 1.0,2 : 0.01,  3 : 10.0, 4 : 0.393701, 5 : 0.0328084, 6 : 0.0109361} 
-    unit_scale_factor = unit_scales[1.0]
+    # publishes always export cm -> cm
+    unit_scale_factor = 1.0
 
     if camera_selection == 1:
-        camera_list = [tde4.getCurrentCamera()]
+        camera_list = [cam]
     elif camera_selection == 2:
         camera_list = tde4.getCameraList(1)
-    elif camera_selection == 3:
-        camera_list = []
-        tcl =  tde4.getCameraList()
-        for c in tcl:
-            if tde4.getCameraType(c) == "SEQUENCE":
-                camera_list.append(c)
-    elif camera_selection == 4:
-        camera_list = []
-        tcl =  tde4.getCameraList()
-        for c in tcl:
-            if tde4.getCameraType(c) == "REF_FRAME":
-                camera_list.append(c)
+    else:
+        # query the full camera list once; the type scan is only needed when
+        # filtering, the default "all cameras" selection skips it entirely.
+        camera_list = tde4.getCameraList()
+        if camera_selection in (3, 4):
+            camera_type = "SEQUENCE" if camera_selection == 3 else "REF_FRAME"
+            getCameraType = tde4.getCameraType
+            camera_list = [c for c in camera_list if getCameraType(c) == camera_type]
 
     path	= path 
     frame0	= startFrame 
@@ -499,18 +552,19 @@ def _export_mel(path):
 
     _maya_export_mel_file(path,campg,camera_list,model_selection,overscan_w_pc,overscan_h_pc,export_material,unit_scale_factor,frame0,hide_ref)
 
-def processFileClean(MelExport_path):
-    extractNm = "."+MelExport_path.rsplit('.',2)[1]
-    cleanFileNm = MelExport_path.replace(extractNm,"")
-    shutil.move(os.path.abspath(MelExport_path),os.path.abspath(cleanFileNm))
-
 def copyToExport(MelExport_path,MelFilePath):
-    if os.path.exists(os.path.abspath(MelExport_path)):
-        mv = shutil.move(os.path.abspath(MelFilePath), os.path.abspath(MelExport_path))
-        processFileClean(mv)
+    # both paths are expected to be absolute, see _copyToMelPath
+    try:
+        # work and publish areas normally share a filesystem, so a plain
+        # rename avoids shutil's copy path entirely
+        os.replace(MelFilePath, MelExport_path)
+    except OSError:
+        # cross device, let shutil copy and delete
+        shutil.move(MelFilePath, MelExport_path)
     
-def _copyToMelPath(s_path,melExpPath):
-    ensure_folder_exists(os.path.abspath(melExpPath))
-    melFilePath = s_path +".mel" 
-    if os.path.isfile(os.path.abspath(melFilePath)):
-        copyToExport(melExpPath,melFilePath)
+def _copyToMelPath(s_path,melPublishPath):
+    mel_abs = os.path.abspath(melPublishPath)
+    src_abs = os.path.abspath(s_path +".mel")
+    _ensure_folder(os.path.dirname(mel_abs))
+    if os.path.isfile(src_abs):
+        copyToExport(mel_abs,src_abs)
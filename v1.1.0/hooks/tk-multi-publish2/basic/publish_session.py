@@ -375,6 +375,7 @@ def _save_session(path):
     """
     # Ensure that the folder is created when saving
     ensure_folder_exists(os.path.dirname(path))
+    tde4.saveProject(path)
 
 def _get_save_as_action():
     """
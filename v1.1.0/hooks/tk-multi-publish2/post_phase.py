@@ -8,21 +8,19 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
-import sgtk
-
+import logging
 import os
 import shutil
 import sgtk
 from sgtk.util.filesystem import ensure_folder_exists
 
-
-import tde4
-from export_maya import *
-
 HookBaseClass = sgtk.get_hook_baseclass()
 
 project_name = "katana_sg_dev"
 
+# separator line for the post phase debug output
+_BANNER = "#" * 81
+
 class PostPhaseMelHook(HookBaseClass):
     """
     This hook defines methods that are executed after each phase of a publish:
@@ -145,37 +143,40 @@ class PostPhaseMelHook(HookBaseClass):
 
  
     def post_finalize(self,publish_tree):
+        # debug output only, don't walk the tree at all when debug is off
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        pname = self.parent.context.project["name"]
+        self.logger.debug("POST FILES PROJECT NAME -> %s", pname)
         for item in publish_tree:
-            boolv = item.checked
-            pname = project_name = self.parent.context.project["name"]
-            print("#################################################################################")
-            print("POST FILES ITEM -> %s"%item)
-            print("POST FILES ITEM CHECHED -> %s"%boolv)
-            print("POST FILES PROJECT NAME -> %s"%pname)
-            print("#################################################################################")
-            # if not item.checked:
-            #     continue
+            if not item.checked:
+                continue
+            self.logger.debug(_BANNER)
+            self.logger.debug("POST FILES ITEM -> %s", item)
+            self.logger.debug(_BANNER)
             for task in item.tasks:
-                # if not task.active:
-                #     continue
-                print("#################################################################################")
-                print("POST FILES IN TASK -> %s"%task)
-                print("#################################################################################")
+                if not task.active:
+                    continue
+                self.logger.debug(_BANNER)
+                self.logger.debug("POST FILES IN TASK -> %s", task)
+                self.logger.debug(_BANNER)
                 for ts in task.settings:
-                    print("#################################################################################")
-                    print("POST FILES IN TASK SETTINGS -> %s"%ts)
-                    print("#################################################################################")
+                    self.logger.debug(_BANNER)
+                    self.logger.debug("POST FILES IN TASK SETTINGS -> %s", ts)
+                    self.logger.debug(_BANNER)
                 # if task.settings["Export 3de4 to Mel"].value is True:
                 #     print("#################################################################################")
                 #     print("POST FILES Task.Settings-> %s"%task)
                 #     #print("POST FILES Task.SettingsEXPORTTOMEL-> %s"%expm)
                 #     print("#################################################################################")
      
+    @staticmethod
     def _session_path():
         """
         Return the path to the current session
         :return:
         """
+        import tde4
         path = tde4.getProjectPath()
         return path
 
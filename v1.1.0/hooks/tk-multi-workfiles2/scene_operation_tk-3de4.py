@@ -3,11 +3,81 @@
 
 import os
 import sgtk
-from sgtk.platform.qt import QtGui
-import tde4
-import sgtk
 HookClass = sgtk.get_hook_baseclass()
 
+# folders already created by _ensure_dir in this session
+_KNOWN_DIRS = set()
+
+# path of the last project save done through _save_project
+_LAST_SAVED_PATH = None
+
+# whether the tde4 path api works with bytes, probed by _tde4_path
+_PATH_AS_BYTES = None
+
+
+def _tde4_path(path):
+    """
+    Return path in the type the tde4 project path api uses.
+
+    Some 3de4 builds hand project paths back as bytes; for those the path is
+    encoded once here rather than converted by the api on every call.
+    """
+    global _PATH_AS_BYTES
+    if _PATH_AS_BYTES is None:
+        import tde4
+        project_path = tde4.getProjectPath()
+        if not project_path:
+            # nothing to probe against until a project has a path
+            return path
+        _PATH_AS_BYTES = isinstance(project_path, bytes)
+    if _PATH_AS_BYTES and not isinstance(path, bytes):
+        return path.encode("UTF-8")
+    return path
+
+
+def _ensure_dir(file_path):
+    """
+    Make sure the folder of file_path exists before saving to it.
+
+    Each folder is only created/checked once per session.
+    """
+    # a bare file name has no folder part, it is saved to the cwd
+    folder = os.path.dirname(file_path) or "."
+    if folder in _KNOWN_DIRS:
+        return
+    os.makedirs(folder, exist_ok=True)
+    _KNOWN_DIRS.add(folder)
+
+
+def _save_project(file_path):
+    """
+    Save the project to file_path.
+
+    workfiles2 can fire several saves in a row (save, version up, save as);
+    a save is skipped when the project is still the one we last wrote to that
+    same path and hasn't changed since.
+    """
+    from sgtk.platform.qt import QtCore, QtGui
+    import tde4
+
+    global _LAST_SAVED_PATH
+    if (
+        file_path == _LAST_SAVED_PATH
+        and tde4.getProjectPath() == _tde4_path(file_path)
+        and tde4.isProjectUpToDate()
+        and os.path.isfile(file_path)
+    ):
+        return
+    _ensure_dir(file_path)
+    # the tde4 api is only safe to call from the main thread, so the save
+    # can't be pushed to a worker; show it's busy instead of looking hung.
+    QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+    try:
+        tde4.saveProject(_tde4_path(file_path))
+    finally:
+        QtGui.QApplication.restoreOverrideCursor()
+    _LAST_SAVED_PATH = file_path
+
 
 class SceneOperation(HookClass):
     """
@@ -49,93 +119,144 @@ class SceneOperation(HookClass):
                                                  state, otherwise False
                                 all others     - None
         """
-        
+
         if operation == "current_path":
-            # return the current scene path
+            # polled often by workfiles2, skip the table lookup and call
             return file_path
-            
-        elif operation == "open":
-            dirty = 0
-            if not tde4.isProjectUpToDate():
-                dirty = 1
-            else:
-                dirty = 0
-            while dirty==1:
-                res = QtGui.QMessageBox.question(None,
-                                                 "Save your scene?",
-                                                 "Your scene has unsaved changes. Save before proceeding?",
-                                                 QtGui.QMessageBox.Yes|QtGui.QMessageBox.No|QtGui.QMessageBox.Cancel)
-            
-                if res == QtGui.QMessageBox.Cancel:
-                    return False
-                elif res == QtGui.QMessageBox.No:
-                    break
-                else:
-                    tde4.saveProject(file_path)
-                    dirty = 0
-            tde4.loadProject(file_path)
-
-        elif operation == "save":
-            if not os.path.exists(os.path.dirname(file_path)):
-                os.makedirs(os.path.dirname(file_path))
-            tde4.saveProject(file_path)
-
-        elif operation == "save_as":
-            if not os.path.exists(os.path.dirname(file_path)):
-                os.makedirs(os.path.dirname(file_path))
-            tde4.saveProject(file_path)
-
-        elif operation == "prepare_new":
-            tde4.newProject()
+
+        handler = SceneOperation._OPS.get(operation)
+        if handler is None:
+            return None
+        return handler(file_path, context, parent_action, file_version, read_only, **kwargs)
+
+    @staticmethod
+    def _op_open(file_path, context, parent_action, file_version, read_only, **kwargs):
+        """
+        Open file_path, offering to save unsaved changes first
+        """
+        import tde4
+
+        if SceneOperation._confirm_save_if_dirty() is None:
+            return False
+        tde4.loadProject(_tde4_path(file_path))
+
+    @staticmethod
+    def _op_save(file_path, context, parent_action, file_version, read_only, **kwargs):
+        """
+        Save the current scene to file_path
+        """
+        _save_project(file_path)
+
+    @staticmethod
+    def _op_save_as(file_path, context, parent_action, file_version, read_only, **kwargs):
+        """
+        Save the current scene as file_path
+        """
+        _save_project(file_path)
+
+    @staticmethod
+    def _op_prepare_new(file_path, context, parent_action, file_version, read_only, **kwargs):
+        """
+        Prepare a new, empty scene
+        """
+        import tde4
+
+        tde4.newProject()
+        return True
+
+    @staticmethod
+    def _op_reset(file_path, context, parent_action, file_version, read_only, **kwargs):
+        """
+        Reset the scene to an empty state
+        """
+        import tde4
+
+        if SceneOperation._confirm_save_if_dirty() is None:
+            return False
+        # do new file:
+        tde4.newProject()
+        return True
+
+    @staticmethod
+    def _confirm_save_if_dirty():
+        """
+        Offer to save the current project if it has unsaved changes.
+
+        :returns: None if the user cancelled, True if there was nothing to save
+                  or the user chose not to, False if the project was saved.
+        """
+        from sgtk.platform.qt import QtGui
+        import tde4
+
+        # queried once, the answer isn't re-checked after the prompt. this
+        # can't be cached across calls: edits made in 3de4 never go through
+        # the hook, so only tde4 knows whether the project is dirty.
+        needs_save = not tde4.isProjectUpToDate()
+        if not needs_save:
             return True
 
-        elif operation == "reset":
-            """
-            Reset the scene to an empty state
-            """
-            dirty = 0
-            if not tde4.isProjectUpToDate():
-                dirty = 1
-            else:
-                dirty = 0
-            while dirty==1:
-                res = QtGui.QMessageBox.question(None,
-                                                 "Save your scene?",
-                                                 "Your scene has unsaved changes. Save before proceeding?",
-                                                 QtGui.QMessageBox.Yes|QtGui.QMessageBox.No|QtGui.QMessageBox.Cancel)
-            
-                if res == QtGui.QMessageBox.Cancel:
-                    return False
-                elif res == QtGui.QMessageBox.No:
-                    break
-                else:
-                    tde4.saveProject(file_path)
-                    dirty = 0
-
-            # do new file:
-            tde4.newProject()
+        # execute() has to return the outcome to workfiles2, so the prompt
+        # stays modal; its nested event loop keeps 3de4 running.
+        box = SceneOperation._dirty_box()
+        box.exec_()
+        res = box.standardButton(box.clickedButton())
+        if res == QtGui.QMessageBox.Cancel:
+            return None
+        elif res == QtGui.QMessageBox.No:
             return True
 
-        # elif operation == "reset":
-        #     if not tde4.isProjectUpToDate():
-        #         res = QtGui.QMessageBox.question(None,
-        #                                          "Save your scene?",
-        #                                          "Your scene has unsaved changes. Save before proceeding?",
-        #                                          QtGui.QMessageBox.Yes|QtGui.QMessageBox.No|QtGui.QMessageBox.Cancel)
-            
-        #         if res == QtGui.QMessageBox.Cancel:
-        #             return False
-        #         elif res == QtGui.QMessageBox.No:
-        #             break
-        #         else:
-        #             if not os.path.exists(os.path.dirname(path)):
-        #                 os.makedirs(os.path.dirname(path))
-        #         tde4.saveProject(path)
-        #     return True
-
-    # def _session_path():
-    #     path = tde4.getProjectPath()
-    #     if isinstance(path, bytes):
-    #         path = path.decode('UTF-8')
-            
-    #     return path
\ No newline at end of file
+        # save the project being closed to its own path, not to the file that
+        # is about to be opened.
+        current_path = tde4.getProjectPath()
+        if isinstance(current_path, bytes):
+            current_path = current_path.decode("UTF-8")
+        if not current_path:
+            QtGui.QMessageBox.warning(
+                None,
+                "Save failed",
+                "The current project has never been saved, use Save As first. Nothing was changed.",
+            )
+            return None
+        _save_project(current_path)
+        # check once that the save went through before the project is replaced
+        if not tde4.isProjectUpToDate():
+            QtGui.QMessageBox.warning(
+                None,
+                "Save failed",
+                "Your scene could not be saved to %s. Nothing was changed." % current_path,
+            )
+            return None
+        return False
+
+    @classmethod
+    def _dirty_box(cls):
+        """
+        Return the "Save your scene?" prompt, built on first use and reused.
+
+        The box is kept on top rather than parented to the active window: a
+        parent would own it, and deleting that window would delete the cached
+        box along with it.
+        """
+        if cls.__dict__.get("_box") is None:
+            from sgtk.platform.qt import QtCore, QtGui
+
+            box = QtGui.QMessageBox(None)
+            box.setIcon(QtGui.QMessageBox.Question)
+            box.setWindowTitle("Save your scene?")
+            box.setText("Your scene has unsaved changes. Save before proceeding?")
+            box.setStandardButtons(
+                QtGui.QMessageBox.Yes|QtGui.QMessageBox.No|QtGui.QMessageBox.Cancel)
+            box.setWindowFlags(box.windowFlags() | QtCore.Qt.WindowStaysOnTopHint)
+            cls._box = box
+        return cls._box
+
+    # operation name -> handler, built once with the class and dispatched by
+    # execute. the handlers are staticmethods so no bound method is created.
+    # current_path is answered by execute before the lookup, so it has none.
+    _OPS = {
+        "open": _op_open.__func__,
+        "save": _op_save.__func__,
+        "save_as": _op_save_as.__func__,
+        "prepare_new": _op_prepare_new.__func__,
+        "reset": _op_reset.__func__,
+    }